@@ -88,6 +88,25 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Tests run concurrent requests, which an in-memory SQLite database can't handle
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+#
+# The menu snapshot and throttling use the default cache. The local-memory backend is
+# per process, so deployments running several worker processes should switch to a
+# shared backend such as Redis or Memcached, otherwise menu changes only reach the
+# other workers once their snapshot expires after MENU_SNAPSHOT['TIMEOUT'].
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -168,3 +187,18 @@ DJOSER = {
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=30),
 }
+
+MENU_SNAPSHOT = {
+    'TIMEOUT': timedelta(minutes=10),
+}
+
+IDEMPOTENCY = {
+    'KEY_LIFETIME': timedelta(hours=24),
+    'IN_PROGRESS_WAIT': timedelta(seconds=5),
+    'IN_PROGRESS_LEASE': timedelta(seconds=30),
+}
+
+ORDER_ARCHIVE = {
+    'AGE': timedelta(days=90),
+    'BATCH_SIZE': 500,
+}
@@ -0,0 +1,93 @@
+import functools
+from itertools import groupby
+
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
+from .models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+
+def archive_orders(cutoff, batch_size):
+    # Moves delivered Orders dated before cutoff into the archive tables, one batch per
+    # transaction so the hot tables are never locked for the whole run
+    archived = 0
+    while True:
+        with transaction.atomic():
+            ids = list(Order.objects.filter(status=True, date__lt=cutoff)
+                       .order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return archived
+
+            ArchivedOrder.objects.bulk_create([
+                ArchivedOrder(
+                    id = order.id,
+                    user_id = order.user_id,
+                    delivery_crew_id = order.delivery_crew_id,
+                    status = order.status,
+                    total = order.total,
+                    date = order.date
+                )
+                for order in Order.objects.filter(id__in=ids)
+            ])
+            ArchivedOrderItem.objects.bulk_create([
+                ArchivedOrderItem(
+                    order_id = item.order_id,
+                    menuitem_id = item.menuitem_id,
+                    quantity = item.quantity,
+                    unit_price = item.unit_price,
+                    price = item.price
+                )
+                for item in OrderItem.objects.filter(order_id__in=ids)
+            ])
+            OrderItem.objects.filter(order_id__in=ids).delete()
+            Order.objects.filter(id__in=ids).delete()
+            archived += len(ids)
+
+def ordering_value(order, field):
+    value = order
+    for name in field.split('__'):
+        if value is None:
+            break
+        value = getattr(value, name)
+    if isinstance(value, models.Model):
+        value = value.pk
+    # Sort nulls first, matching how SQLite orders them
+    return (value is not None, value)
+
+class OrderHistory:
+    """
+    Hot and archived Orders as one ordered sequence for pagination. Both querysets
+    get the same ordering, and slicing reads the first stop rows from each before
+    merging them, so deep pages cost O(offset) rows per tier. Order items are only
+    prefetched for the returned page.
+    """
+    def __init__(self, hot, archived, ordering):
+        self.ordering = list(ordering) + ['id']
+        self.hot = hot.prefetch_related(None).select_related('user', 'delivery_crew').order_by(*self.ordering)
+        self.archived = archived.prefetch_related(None).select_related('user', 'delivery_crew').order_by(*self.ordering)
+
+    def compare(self, a, b):
+        for field in self.ordering:
+            descending = field.startswith('-')
+            name = field.lstrip('-')
+            a_value, b_value = ordering_value(a, name), ordering_value(b, name)
+            if a_value != b_value:
+                result = -1 if a_value < b_value else 1
+                return -result if descending else result
+        return 0
+
+    def count(self):
+        return self.hot.count() + self.archived.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        orders = list(self.hot[:stop]) + list(self.archived[:stop])
+        orders.sort(key=functools.cmp_to_key(self.compare))
+        page = orders[start:stop]
+        # Hot and archived Orders keep their items in separate tables, so prefetch per model
+        for _, model_orders in groupby(sorted(page, key=lambda order: order._meta.label), key=type):
+            prefetch_related_objects(list(model_orders), 'orderitems__menuitem')
+        return page
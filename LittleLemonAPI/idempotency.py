@@ -0,0 +1,139 @@
+import functools
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from rest_framework import response, status
+from rest_framework.exceptions import APIException
+from .models import IdempotencyKey
+
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.5
+
+def request_hash(request):
+    # Hash the parsed data rather than request.body, which can't be read once the
+    # CSRF check of SessionAuthentication has consumed a multipart stream
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    return hashlib.sha256(json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode('utf-8')).hexdigest()
+
+def is_expired(record, now):
+    # Expired keys can be claimed again by any request
+    return record.created < now - settings.IDEMPOTENCY['KEY_LIFETIME']
+
+def lease_expired(record, now):
+    # Unfinished claims whose lease ran out (e.g. the worker died) can be claimed again by a retry
+    return record.status_code is None and record.claimed < now - settings.IDEMPOTENCY['IN_PROGRESS_LEASE']
+
+def take_over(record, request, body_hash, now):
+    # Conditional on the claim we read, so only one of several concurrent claimers wins
+    taken = IdempotencyKey.objects.filter(
+        pk=record.pk, claimed=record.claimed, status_code=record.status_code
+    ).update(claimed=now, created=now, method=request.method, path=request.path,
+             body_hash=body_hash, status_code=None, response_body=None)
+    if taken:
+        record.claimed = record.created = now
+        record.method, record.path, record.body_hash = request.method, request.path, body_hash
+        record.status_code = record.response_body = None
+    return taken
+
+def claim_key(request, key, body_hash):
+    # Returns (record, True) when this request owns the key, or (record, False) for a duplicate
+    while True:
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=request.user,
+                    key=key,
+                    method=request.method,
+                    path=request.path,
+                    body_hash=body_hash,
+                    claimed=now,
+                )
+            return record, True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            # The owner may have failed and released the key in between, claim it again
+            if record is None:
+                continue
+            if is_expired(record, now) or (lease_expired(record, now) and matches(record, request, body_hash)):
+                if take_over(record, request, body_hash, now):
+                    return record, True
+                continue
+            return record, False
+
+def matches(record, request, body_hash):
+    return record.method == request.method and record.path == request.path and record.body_hash == body_hash
+
+def wait_for_response(record):
+    # Concurrent duplicates wait for the first request to store its response,
+    # polling less often the longer it takes
+    deadline = time.monotonic() + settings.IDEMPOTENCY['IN_PROGRESS_WAIT'].total_seconds()
+    interval = POLL_INTERVAL
+    while record is not None and record.status_code is None:
+        if time.monotonic() + interval > deadline:
+            return None
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+    return record
+
+def purge_expired_keys():
+    cutoff = timezone.now() - settings.IDEMPOTENCY['KEY_LIFETIME']
+    deleted, _ = IdempotencyKey.objects.filter(created__lt=cutoff).delete()
+    return deleted
+
+# Handlers decorated with idempotent run once per Idempotency-Key header,
+# retries with the same key get the stored response instead
+def idempotent(handler):
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return response.Response({'detail': 'idempotency key too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+        body_hash = request_hash(request)
+        record, owner = claim_key(request, key, body_hash)
+        if not owner:
+            if not matches(record, request, body_hash):
+                return response.Response({'detail': 'idempotency key already used for another request'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            record = wait_for_response(record)
+            if record is None:
+                return response.Response({'detail': 'request with this idempotency key is still in progress'}, status=status.HTTP_409_CONFLICT)
+            return response.Response(record.response_body, status=record.status_code)
+
+        # Only touch the record while it is still our claim, it may have been taken over
+        claim = IdempotencyKey.objects.filter(pk=record.pk, claimed=record.claimed)
+        # The handler's writes commit together with the stored response, and a released
+        # key always matches rolled back writes, so a retry never repeats a partial checkout
+        try:
+            with transaction.atomic():
+                # Writing the claim first takes SQLite's write lock before the handler reads,
+                # so concurrent writers wait instead of failing to upgrade a read lock
+                if not claim.update(claimed=record.claimed):
+                    return response.Response({'detail': 'request with this idempotency key is still in progress'}, status=status.HTTP_409_CONFLICT)
+                handler_response = handler(self, request, *args, **kwargs)
+                if handler_response.status_code >= 500:
+                    transaction.set_rollback(True)
+                else:
+                    claim.update(status_code=handler_response.status_code, response_body=handler_response.data)
+        except APIException as exc:
+            handler_response = self.handle_exception(exc)
+            if handler_response.status_code < 500:
+                claim.update(status_code=handler_response.status_code, response_body=handler_response.data)
+        except Exception:
+            claim.delete()
+            raise
+        # Server errors are not stored so the client can retry them
+        if handler_response.status_code >= 500:
+            claim.delete()
+        return handler_response
+    return wrapper
@@ -0,0 +1,20 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from LittleLemonAPI.archive import archive_orders
+
+class Command(BaseCommand):
+    help = 'Moves delivered Orders older than the configured age into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ORDER_ARCHIVE['AGE'].days,
+                            help='Archive delivered Orders older than this many days')
+        parser.add_argument('--batch-size', type=int, default=settings.ORDER_ARCHIVE['BATCH_SIZE'],
+                            help='Number of Orders moved per transaction')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now().date() - datetime.timedelta(days=options['days'])
+        archived = archive_orders(cutoff, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} orders dated before {cutoff}'))
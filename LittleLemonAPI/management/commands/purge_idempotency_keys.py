@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.idempotency import purge_expired_keys
+
+class Command(BaseCommand):
+    help = 'Deletes Idempotency-Key records older than the configured key lifetime'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_keys()
+        self.stdout.write(self.style.SUCCESS(f'Purged {deleted} expired idempotency keys'))
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:01
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0004_archivedorder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='body_hash',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='claimed',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 
 class Category(models.Model):
     slug = models.SlugField()
@@ -50,3 +52,42 @@ class OrderItem(models.Model):
     
     def __str__(self) -> str:
         return f"{self.quantity} x {self.menuitem.title}"
+
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    # SHA-256 of the parsed request data, so a key reused with another payload is rejected
+    body_hash = models.CharField(max_length=64, default='')
+    # status_code stays null while the first request is still being processed
+    status_code = models.SmallIntegerField(null=True)
+    response_body = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    # Index created field since expired keys are purged against it
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Start of the current claim, an unfinished claim can be taken over once its lease expires
+    claimed = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+# Archive tables for delivered Orders, moved out of Order and OrderItem by the
+# archive_orders command. Ids are kept from the original Order, and only the
+# foreign keys are indexed to keep the tables compact.
+class ArchivedOrder(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    delivery_crew = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_deliveries', null=True)
+    status = models.BooleanField(default=0)
+    total = models.DecimalField(max_digits=6, decimal_places=2)
+    date = models.DateField()
+    archived = models.DateField(auto_now_add=True)
+
+class ArchivedOrderItem(models.Model):
+    order = models.ForeignKey(ArchivedOrder, related_name='orderitems', on_delete=models.CASCADE)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='+')
+    quantity = models.SmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    price = models.DecimalField(max_digits=6, decimal_places=2)
+
+    def __str__(self) -> str:
+        return f"{self.quantity} x {self.menuitem.title}"
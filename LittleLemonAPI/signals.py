@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Category, MenuItem
+from .snapshot import invalidate_snapshot
+
+# Move to a new menu snapshot whenever the menu changes, once the change is
+# committed so a rebuild can't read the old rows; the next request regenerates it
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+def menu_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_snapshot)
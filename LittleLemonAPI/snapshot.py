@@ -0,0 +1,110 @@
+import gzip
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from rest_framework.utils.encoders import JSONEncoder
+from .models import Category, MenuItem
+from .serializers import CategorySerializer, MenuItemSerializer
+
+# brotli is optional, snapshots are still served gzipped without it
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SNAPSHOT_CACHE_KEY = 'LittleLemonAPI:menu-snapshot:%s'
+GENERATION_CACHE_KEY = 'LittleLemonAPI:menu-snapshot-generation'
+
+# Preferred first when the client accepts both with the same q-value
+ENCODINGS = ('br', 'gzip')
+
+def build_snapshot():
+    # Render every Category with its MenuItems into one JSON body, and precompress it
+    # so requests for the full menu never touch the database or the serializers
+    categories = Category.objects.order_by('id').prefetch_related(
+        Prefetch('menuitem_set', queryset=MenuItem.objects.order_by('id').select_related('category'))
+    )
+    data = []
+    for category in categories:
+        entry = CategorySerializer(category).data
+        entry['menuitems'] = MenuItemSerializer(category.menuitem_set.all(), many=True).data
+        data.append(entry)
+
+    body = json.dumps(data, cls=JSONEncoder, separators=(',', ':')).encode('utf-8')
+    snapshot = {
+        'hash': hashlib.sha256(body).hexdigest(),
+        'identity': body,
+        'gzip': gzip.compress(body),
+    }
+    if brotli is not None:
+        snapshot['br'] = brotli.compress(body)
+    return snapshot
+
+def snapshot_etag(snapshot, encoding):
+    # Each encoding is a different representation, so each gets its own strong ETag
+    if encoding == 'identity':
+        return '"%s"' % snapshot['hash']
+    return '"%s-%s"' % (snapshot['hash'], encoding)
+
+def new_generation():
+    # Time based, so a generation counter lost to eviction never restarts at an old value
+    return time.time_ns()
+
+def get_generation():
+    generation = cache.get(GENERATION_CACHE_KEY)
+    if generation is None:
+        cache.add(GENERATION_CACHE_KEY, new_generation(), None)
+        generation = cache.get(GENERATION_CACHE_KEY)
+    return generation
+
+def get_snapshot():
+    # Read the generation before building, so a snapshot built from rows that
+    # change meanwhile is stored under a generation that is already outdated
+    key = SNAPSHOT_CACHE_KEY % get_generation()
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_snapshot()
+        cache.set(key, snapshot, settings.MENU_SNAPSHOT['TIMEOUT'].total_seconds())
+    return snapshot
+
+def invalidate_snapshot():
+    # Bumping the generation moves every process sharing the cache to a new snapshot key
+    try:
+        cache.incr(GENERATION_CACHE_KEY)
+    except ValueError:
+        cache.add(GENERATION_CACHE_KEY, new_generation(), None)
+
+def parse_accept_encoding(header):
+    qvalues = {}
+    for coding in header.split(','):
+        name, _, params = coding.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        qvalue = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[name] = qvalue
+    return qvalues
+
+def choose_encoding(snapshot, header):
+    # Picks the available encoding with the highest q-value, skipping q=0,
+    # and falls back to identity when the client prefers it or accepts nothing else
+    qvalues = parse_accept_encoding(header)
+    best, best_qvalue = 'identity', qvalues.get('identity', 0.0)
+    for encoding in ENCODINGS:
+        if encoding not in snapshot:
+            continue
+        qvalue = qvalues.get(encoding, qvalues.get('*', 0.0))
+        if qvalue > best_qvalue:
+            best, best_qvalue = encoding, qvalue
+    return best
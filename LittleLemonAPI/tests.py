@@ -1,3 +1,277 @@
-from django.test import TestCase
+import datetime
+import gzip
+import hashlib
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase
+from django.contrib.auth.models import User, Group
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .archive import OrderHistory
+from .models import Category, MenuItem, Cart, Order, OrderItem, IdempotencyKey, ArchivedOrder
 
-# Create your tests here.
+class LittleLemonTestMixin:
+    # Shared customer, menu and authenticated client, for TestCase and TransactionTestCase
+    def setUp(self):
+        # Throttle history and the menu snapshot live in the cache, which outlives each test
+        cache.clear()
+        self.user = User.objects.create_user(username='customer', password='password')
+        self.category = Category.objects.create(slug='mains', title='Mains')
+        self.menuitem = MenuItem.objects.create(title='Pasta', price='12.50', featured=False, category=self.category)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+class MenuSnapshotTest(LittleLemonTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.empty_category = Category.objects.create(slug='desserts', title='Desserts')
+
+    def test_menu_has_every_category_with_its_items(self):
+        menu = self.client.get('/api/menu')
+        self.assertEqual(menu.status_code, 200)
+        self.assertEqual(json.loads(menu.content), [
+            {'id': self.category.id, 'title': 'Mains', 'menuitems': [
+                {'id': self.menuitem.id, 'title': 'Pasta', 'price': '12.50', 'featured': False, 'category_title': 'Mains'},
+            ]},
+            {'id': self.empty_category.id, 'title': 'Desserts', 'menuitems': []},
+        ])
+
+    def test_anonymous_get_and_head(self):
+        anonymous = APIClient()
+        self.assertEqual(anonymous.get('/api/menu').status_code, 200)
+        head = anonymous.head('/api/menu')
+        self.assertEqual(head.status_code, 200)
+        self.assertTrue(head.has_header('ETag'))
+
+    def test_encoding_follows_accept_encoding(self):
+        identity = self.client.get('/api/menu')
+        self.assertFalse(identity.has_header('Content-Encoding'))
+        gzipped = self.client.get('/api/menu', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(gzipped.content), identity.content)
+        self.assertNotEqual(gzipped['ETag'], identity['ETag'])
+        refused = self.client.get('/api/menu', HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(refused.has_header('Content-Encoding'))
+
+    def test_matching_etag_is_not_modified(self):
+        menu = self.client.get('/api/menu', HTTP_ACCEPT_ENCODING='gzip')
+        cached = self.client.get('/api/menu', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=menu['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        # The gzip ETag doesn't validate the identity representation
+        other_encoding = self.client.get('/api/menu', HTTP_IF_NONE_MATCH=menu['ETag'])
+        self.assertEqual(other_encoding.status_code, 200)
+
+    def assertMenuChanges(self, change):
+        before = self.client.get('/api/menu')
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        after = self.client.get('/api/menu')
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        self.assertNotEqual(after.content, before.content)
+
+    def test_menu_changes_regenerate_snapshot(self):
+        def save_menuitem():
+            self.menuitem.title = 'Lasagne'
+            self.menuitem.save()
+        self.assertMenuChanges(save_menuitem)
+        self.assertMenuChanges(lambda: self.menuitem.delete())
+        def save_category():
+            self.category.title = 'Main courses'
+            self.category.save()
+        self.assertMenuChanges(save_category)
+        self.assertMenuChanges(lambda: self.empty_category.delete())
+
+class IdempotencyKeyTest(LittleLemonTestMixin, TestCase):
+    def test_cart_retry_returns_stored_response(self):
+        payload = {'menuitem': self.menuitem.id, 'quantity': 2}
+        first = self.client.post('/api/cart/menu-items', payload, HTTP_IDEMPOTENCY_KEY='cart-1')
+        retry = self.client.post('/api/cart/menu-items', payload, HTTP_IDEMPOTENCY_KEY='cart-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 1)
+
+    def test_checkout_retry_creates_one_order(self):
+        Cart.objects.create(user=self.user, menuitem=self.menuitem, quantity=1, unit_price='12.50', price='12.50')
+        first = self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='order-1')
+        retry = self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='order-1')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.data, {'detail': 'order created'})
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+
+    def test_key_reused_for_another_endpoint(self):
+        Cart.objects.create(user=self.user, menuitem=self.menuitem, quantity=1, unit_price='12.50', price='12.50')
+        self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='shared')
+        reused = self.client.post('/api/cart/menu-items', {'menuitem': self.menuitem.id, 'quantity': 1}, HTTP_IDEMPOTENCY_KEY='shared')
+        self.assertEqual(reused.status_code, 422)
+
+    def test_client_error_is_stored(self):
+        empty = self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='order-2')
+        self.assertEqual(empty.status_code, 400)
+        self.assertEqual(IdempotencyKey.objects.get(key='order-2').status_code, 400)
+
+    def test_key_reused_with_another_body(self):
+        self.client.post('/api/cart/menu-items', {'menuitem': self.menuitem.id, 'quantity': 1}, HTTP_IDEMPOTENCY_KEY='cart-2')
+        reused = self.client.post('/api/cart/menu-items', {'menuitem': self.menuitem.id, 'quantity': 3}, HTTP_IDEMPOTENCY_KEY='cart-2')
+        self.assertEqual(reused.status_code, 422)
+        self.assertEqual(Cart.objects.get(user=self.user).quantity, 1)
+
+    def test_validation_error_is_stored(self):
+        invalid = self.client.post('/api/cart/menu-items', {'menuitem': 0, 'quantity': 1}, HTTP_IDEMPOTENCY_KEY='cart-3')
+        self.assertEqual(invalid.status_code, 400)
+        self.assertEqual(IdempotencyKey.objects.get(key='cart-3').status_code, 400)
+        retry = self.client.post('/api/cart/menu-items', {'menuitem': 0, 'quantity': 1}, HTTP_IDEMPOTENCY_KEY='cart-3')
+        self.assertEqual(retry.status_code, 400)
+        self.assertEqual(retry.data, invalid.data)
+
+    def test_unfinished_claim_is_taken_over_after_lease(self):
+        Cart.objects.create(user=self.user, menuitem=self.menuitem, quantity=1, unit_price='12.50', price='12.50')
+        # Left behind by a worker that died while handling the first checkout
+        IdempotencyKey.objects.create(user=self.user, key='order-3', method='POST', path='/api/orders',
+                                      body_hash=hashlib.sha256(b'{}').hexdigest(),
+                                      claimed=timezone.now() - datetime.timedelta(minutes=5))
+        retry = self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='order-3')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(IdempotencyKey.objects.get(key='order-3').status_code, 200)
+
+    def test_unfinished_claim_within_lease_conflicts(self):
+        IdempotencyKey.objects.create(user=self.user, key='order-4', method='POST', path='/api/orders',
+                                      body_hash=hashlib.sha256(b'{}').hexdigest())
+        with self.settings(IDEMPOTENCY={**settings.IDEMPOTENCY, 'IN_PROGRESS_WAIT': datetime.timedelta(0)}):
+            retry = self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='order-4')
+        self.assertEqual(retry.status_code, 409)
+
+    def test_expired_key_is_claimed_by_another_request(self):
+        expired = IdempotencyKey.objects.create(user=self.user, key='cart-4', method='POST', path='/api/orders',
+                                                status_code=200, response_body={'detail': 'order created'})
+        IdempotencyKey.objects.filter(pk=expired.pk).update(created=timezone.now() - datetime.timedelta(days=3))
+        reused = self.client.post('/api/cart/menu-items', {'menuitem': self.menuitem.id, 'quantity': 1}, HTTP_IDEMPOTENCY_KEY='cart-4')
+        self.assertEqual(reused.status_code, 201)
+        self.assertEqual(IdempotencyKey.objects.get(key='cart-4').path, '/api/cart/menu-items')
+
+    def test_failed_checkout_rolls_back_with_released_key(self):
+        Cart.objects.create(user=self.user, menuitem=self.menuitem, quantity=1, unit_price='12.50', price='12.50')
+        with mock.patch('LittleLemonAPI.views.OrderItem.save', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='order-5')
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(IdempotencyKey.objects.filter(key='order-5').exists())
+        retry = self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='order-5')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+
+    def test_session_auth_multipart_with_csrf(self):
+        client = APIClient(enforce_csrf_checks=True)
+        client.login(username='customer', password='password')
+        token = 'a' * 32
+        client.cookies['csrftoken'] = token
+        # The CSRF check reads the token from the multipart body before the view runs
+        payload = {'menuitem': self.menuitem.id, 'quantity': 1, 'csrfmiddlewaretoken': token}
+        first = client.post('/api/cart/menu-items', payload, HTTP_IDEMPOTENCY_KEY='cart-5')
+        retry = client.post('/api/cart/menu-items', payload, HTTP_IDEMPOTENCY_KEY='cart-5')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 1)
+
+    def test_purge_removes_expired_keys(self):
+        expired = IdempotencyKey.objects.create(user=self.user, key='old', method='POST', path='/api/orders')
+        IdempotencyKey.objects.filter(pk=expired.pk).update(created=timezone.now() - datetime.timedelta(days=2))
+        IdempotencyKey.objects.create(user=self.user, key='new', method='POST', path='/api/orders')
+        call_command('purge_idempotency_keys', stdout=io.StringIO())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
+class OrderArchiveTest(LittleLemonTestMixin, TestCase):
+    def create_order(self, days_ago, delivered=True, menuitem=None):
+        order = Order.objects.create(user=self.user, status=delivered, total='12.50',
+                                     date=datetime.date.today() - datetime.timedelta(days=days_ago))
+        OrderItem.objects.create(order=order, menuitem=menuitem or self.menuitem, quantity=1, unit_price='12.50', price='12.50')
+        return order
+
+    def test_archive_moves_old_delivered_orders(self):
+        old = self.create_order(days_ago=200)
+        undelivered = self.create_order(days_ago=200, delivered=False)
+        recent = self.create_order(days_ago=1)
+        call_command('archive_orders', days=90, batch_size=1, stdout=io.StringIO())
+        self.assertEqual(list(Order.objects.values_list('id', flat=True).order_by('id')), [undelivered.id, recent.id])
+        archived = ArchivedOrder.objects.get(pk=old.id)
+        self.assertEqual([str(item) for item in archived.orderitems.all()], ['1 x Pasta'])
+
+    def test_archived_order_stays_readable(self):
+        old = self.create_order(days_ago=200)
+        call_command('archive_orders', stdout=io.StringIO())
+        detail = self.client.get(f'/api/orders/{old.id}', {'format': 'json'})
+        self.assertEqual(detail.status_code, 200)
+        self.assertEqual(detail.data['orderitems'], ['1 x Pasta'])
+        # Archived Orders are read only, even for Managers
+        manager = User.objects.create_user(username='manager', password='password')
+        manager.groups.add(Group.objects.create(name='Manager'))
+        self.client.force_authenticate(manager)
+        self.assertEqual(self.client.patch(f'/api/orders/{old.id}', {'status': 0}).status_code, 404)
+
+    def test_order_list_include_archived(self):
+        orders = [self.create_order(days_ago=days) for days in (300, 1, 200, 2)]
+        call_command('archive_orders', stdout=io.StringIO())
+        hot = self.client.get('/api/orders', {'format': 'json'})
+        self.assertEqual(hot.data['count'], 2)
+        combined = self.client.get('/api/orders', {'format': 'json', 'include_archived': 'true', 'ordering': 'date'})
+        self.assertEqual(combined.data['count'], 4)
+        self.assertEqual([order['id'] for order in combined.data['results']], [orders[0].id, orders[2].id, orders[3].id])
+        last_page = self.client.get('/api/orders', {'format': 'json', 'include_archived': 'true', 'ordering': 'date', 'page': 2})
+        self.assertEqual([order['id'] for order in last_page.data['results']], [orders[1].id])
+
+    def test_order_list_include_archived_search(self):
+        soup = MenuItem.objects.create(title='Soup', price='6.00', featured=False, category=self.category)
+        archived_soup = self.create_order(days_ago=200, menuitem=soup)
+        self.create_order(days_ago=200)
+        hot_soup = self.create_order(days_ago=1, menuitem=soup)
+        self.create_order(days_ago=1)
+        call_command('archive_orders', stdout=io.StringIO())
+        hot = self.client.get('/api/orders', {'format': 'json', 'search': 'soup'})
+        self.assertEqual([order['id'] for order in hot.data['results']], [hot_soup.id])
+        combined = self.client.get('/api/orders', {'format': 'json', 'include_archived': 'true', 'search': 'soup', 'ordering': '-date'})
+        self.assertEqual(combined.data['count'], 2)
+        self.assertEqual([order['id'] for order in combined.data['results']], [hot_soup.id, archived_soup.id])
+
+    def test_order_history_prefetches_only_the_page(self):
+        recent = self.create_order(days_ago=1)
+        self.create_order(days_ago=200)
+        call_command('archive_orders', stdout=io.StringIO())
+        history = OrderHistory(Order.objects.prefetch_related('orderitems'),
+                               ArchivedOrder.objects.prefetch_related('orderitems'), ['-date'])
+        with CaptureQueriesContext(connection) as queries:
+            page = history[0:1]
+        self.assertEqual(page, [recent])
+        self.assertEqual([str(item) for item in page[0].orderitems.all()], ['1 x Pasta'])
+        # The archived Order was read to merge the page, but its items were never fetched
+        self.assertFalse(any('archivedorderitem' in query['sql'].lower() for query in queries))
+
+class ConcurrentCheckoutTest(LittleLemonTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        Cart.objects.create(user=self.user, menuitem=self.menuitem, quantity=1, unit_price='12.50', price='12.50')
+
+    def checkout(self, key):
+        try:
+            client = APIClient()
+            client.force_authenticate(self.user)
+            return client.post('/api/orders', HTTP_IDEMPOTENCY_KEY=key)
+        finally:
+            connection.close()
+
+    def test_parallel_duplicate_checkouts_create_one_order(self):
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            responses = list(executor.map(self.checkout, ['checkout-1'] * 5))
+        for checkout_response in responses:
+            self.assertEqual(checkout_response.status_code, 200)
+            self.assertEqual(checkout_response.data, {'detail': 'order created'})
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 0)
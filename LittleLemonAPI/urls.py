@@ -7,6 +7,7 @@ urlpatterns = [
 
     path('menu-items', views.MenuItemsView.as_view(), name='MenuItemsView'),
     path('menu-items/<int:pk>', views.SingleMenuItemView.as_view(), name='SingleMenuItemView'),
+    path('menu', views.MenuSnapshotView.as_view(), name='MenuSnapshotView'),
 
     path('groups/manager/users', views.ManagerView.as_view({'get': 'list', 'post': 'create',}), name='ManagerView'),
     path('groups/manager/users/<int:pk>', views.ManagerView.as_view({'delete': 'destroy',})),
@@ -1,12 +1,17 @@
 from django.shortcuts import render, get_object_or_404
+from django.http import HttpResponse, Http404
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django.contrib.auth.models import User, Group
-from rest_framework import generics, viewsets, response, status
+from rest_framework import generics, viewsets, response, status, views
 from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
-from rest_framework.permissions import IsAuthenticated, IsAdminUser, SAFE_METHODS
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser, SAFE_METHODS
 from rest_framework.exceptions import PermissionDenied
 from .permissions import IsManager, IsManagerOrReadOnly, IsDeliveryCrew
-from .models import Category, MenuItem, Cart, OrderItem, Order
+from .models import Category, MenuItem, Cart, OrderItem, Order, ArchivedOrder
 from .serializers import CategorySerializer, MenuItemSerializer, UserSerializer, CartSerializer, OrderItemSerializer, OrderSerializer
+from .snapshot import get_snapshot, snapshot_etag, choose_encoding
+from .idempotency import idempotent
+from .archive import OrderHistory
 
 import datetime
     
@@ -37,6 +42,29 @@ class SingleMenuItemView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = MenuItemSerializer
     permission_classes = [IsManagerOrReadOnly]
 
+class MenuSnapshotView(views.APIView):
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    # Read only, the view only defines get (and HEAD through it)
+    permission_classes = [AllowAny]
+
+    # Returns the whole menu in one request from the precomputed snapshot,
+    # already compressed and with an ETag so unchanged menus cost a 304
+    def get(self, request, *args, **kwargs):
+        snapshot = get_snapshot()
+        encoding = choose_encoding(snapshot, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        etag = snapshot_etag(snapshot, encoding)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            patch_vary_headers(not_modified, ('Accept-Encoding',))
+            return not_modified
+
+        snapshot_response = HttpResponse(snapshot[encoding], content_type='application/json')
+        if encoding != 'identity':
+            snapshot_response['Content-Encoding'] = encoding
+        snapshot_response['ETag'] = etag
+        patch_vary_headers(snapshot_response, ('Accept-Encoding',))
+        return snapshot_response
+
 class BaseGroupView(viewsets.ViewSet):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
     permission_classes = None
@@ -89,6 +117,10 @@ class CartView(generics.ListCreateAPIView):
         context = super().get_serializer_context()
         context.update({'request':self.request})
         return context
+
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
     
     def delete(self, request, *args, **kwargs):
         queryset = self.get_queryset()
@@ -103,14 +135,27 @@ class OrderView(generics.ListCreateAPIView):
     search_fields = ['user__username', 'delivery_crew__username', 'orderitems__menuitem__title']
 
     def get_queryset(self):
+        return self.get_orders(Order)
+
+    def get_orders(self, model):
         # Managers can see all Orders
         if IsManager.has_permission(self, self.request, None):
-            return Order.objects.all().prefetch_related('orderitems').all()
+            return model.objects.all().prefetch_related('orderitems').all()
         # Delivery crew can only see Orders they're assigned to deliver
         if IsDeliveryCrew.has_permission(self, self.request, None):
-            return Order.objects.filter(delivery_crew=self.request.user).prefetch_related('orderitems').all()
+            return model.objects.filter(delivery_crew=self.request.user).prefetch_related('orderitems').all()
         # Customers can see their own orders
-        return Order.objects.filter(user=self.request.user).prefetch_related('orderitems').all()
+        return model.objects.filter(user=self.request.user).prefetch_related('orderitems').all()
+
+    # ?include_archived=true lists archived Orders together with the current ones,
+    # with the same search and ordering applied to both
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        include_archived = self.request.query_params.get('include_archived', '').lower() in ('1', 'true', 'yes')
+        if self.request.method not in SAFE_METHODS or not include_archived:
+            return queryset
+        archived = super().filter_queryset(self.get_orders(ArchivedOrder))
+        return OrderHistory(queryset, archived, queryset.query.order_by)
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
@@ -120,6 +165,7 @@ class OrderView(generics.ListCreateAPIView):
 
     # POST request sent to endpoint should retrieve all items in Cart, create an Order,
     # create OrderItems for all the Cart items, assign the OrderItems to the Order
+    @idempotent
     def post(self, request, *args, **kwargs):
         cart = Cart.objects.filter(user=self.request.user)
         if cart.count() > 0:
@@ -160,7 +206,7 @@ class SingleOrderView(generics.RetrieveUpdateDestroyAPIView):
         # Allow only Managers and the Order's customer to see a specific Order
         if request.method in SAFE_METHODS:
             pk = self.kwargs['pk']
-            order = get_object_or_404(Order, pk=pk)
+            order = Order.objects.filter(pk=pk).first() or get_object_or_404(ArchivedOrder, pk=pk)
             if not is_manager and order.user != request.user:
                 raise PermissionDenied()
         # Allow only Managers and Delivery crew to make partial updates
@@ -174,6 +220,15 @@ class SingleOrderView(generics.RetrieveUpdateDestroyAPIView):
 
         return super().check_permissions(request)
 
+    # Archived Orders are read only, so only safe methods fall back to the archive
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.request.method not in SAFE_METHODS:
+                raise
+            return get_object_or_404(ArchivedOrder.objects.prefetch_related('orderitems'), pk=self.kwargs['pk'])
+
     def patch(self, request, *args, **kwargs):
         # Delivery crew can only change Order status
         if not IsManager.has_permission(self, request, None):